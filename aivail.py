@@ -533,9 +533,10 @@ class LLMFlow:
             for entry in self.flow_log:
                 f.write(json.dumps(entry) + '\n')
 
-def define_default_flow(model_name: str = "distilgpt2", num_layers: int = 2) -> LLMFlow:
+def define_default_flow(model_name: str = "distilgpt2", num_layers: int = 2, model_manager: Optional[ModelManager] = None) -> LLMFlow:
     reference_input = "Hello, world!"
-    model_manager = ModelManager(model_name)
+    if model_manager is None:
+        model_manager = ModelManager(model_name)
     steps = [
         ("tokenize", TokenizerModule(model_manager), {}),
         ("embed", EmbedderModule(model_manager), {}),
@@ -2,21 +2,42 @@ import logging
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
-import json
+from typing import Optional, List, Dict, Any, Callable
+from contextlib import asynccontextmanager
+import asyncio
 import os
+import tempfile
+import threading
+import msgspec
 from sheeva import define_default_flow as define_crypto_flow, TCCFlow
-from aivail import define_default_flow as define_llm_flow, LLMFlow, LLMCoordinator, LLMEntropyEngine
+from aivail import define_default_flow as define_llm_flow, LLMFlow, LLMCoordinator, LLMEntropyEngine, ModelManager
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+DEFAULT_MODEL_NAME = "distilgpt2"
+LOG_FILES = frozenset({"tcc_flow_log.jsonl", "llm_flow_log.jsonl"})
+tcc_log_lock = threading.Lock()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the default model once per worker so aivail requests don't reload it
+    try:
+        app.state.model_manager = await asyncio.to_thread(ModelManager, DEFAULT_MODEL_NAME)
+        app.state.model_preload_error = None
+        logger.info(f"Preloaded model {DEFAULT_MODEL_NAME}")
+    except Exception as e:
+        logger.warning(f"Failed to preload model {DEFAULT_MODEL_NAME}: {str(e)}")
+        app.state.model_manager = None
+        app.state.model_preload_error = str(e)
+    yield
+
 # Initialize FastAPI app
 try:
-    app = FastAPI(title="TCC Flow API", description="API for executing Sheeva and Aivail flows", version="1.0.0")
+    app = FastAPI(title="TCC Flow API", description="API for executing Sheeva and Aivail flows", version="1.0.0", lifespan=lifespan)
     logger.info("FastAPI app initialized successfully")
 
     # Mount static directory for index.html
@@ -61,7 +82,8 @@ class ExecuteInput(BaseModel):
     fee: Optional[int] = 1000
     deploy_shard: Optional[bool] = False
 
-class LogEntry(BaseModel):
+# Response payloads are msgspec structs; request bodies stay on pydantic
+class LogEntry(msgspec.Struct):
     step: int
     operation: str
     input_data: str
@@ -74,33 +96,105 @@ class LogEntry(BaseModel):
     timestamp: int
     execution_time_ns: int
 
-class ExecuteResponse(BaseModel):
+class ExecuteResponse(msgspec.Struct):
     output: str
     logs: List[LogEntry]
 
-class LogsResponse(BaseModel):
+class LogsResponse(msgspec.Struct):
     logs: List[LogEntry]
 
-# Utility function
+class MsgspecJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return msgspec.json.encode(content)
+
+log_entry_decoder = msgspec.json.Decoder(LogEntry)
+
+# FastAPI only derives response schemas from pydantic models, so publish the msgspec ones by hand
+(execute_response_schema, logs_response_schema), msgspec_schema_components = msgspec.json.schema_components(
+    [ExecuteResponse, LogsResponse], ref_template="#/components/schemas/{name}"
+)
+EXECUTE_RESPONSES = {
+    200: {"description": "Successful Response", "content": {"application/json": {"schema": execute_response_schema}}}
+}
+LOGS_RESPONSES = {
+    200: {"description": "Successful Response", "content": {"application/json": {"schema": logs_response_schema}}}
+}
+
+def openapi_with_msgspec_schemas() -> Dict[str, Any]:
+    if app.openapi_schema is None:
+        schema = FastAPI.openapi(app)
+        schema.setdefault("components", {}).setdefault("schemas", {}).update(msgspec_schema_components)
+    return app.openapi_schema
+
+app.openapi = openapi_with_msgspec_schemas
+
+# Utility functions
 def read_logs(log_file: str) -> List[LogEntry]:
     logs = []
     try:
         if not os.path.exists(log_file):
             logger.info(f"Log file {log_file} not found, creating empty file")
-            with open(log_file, "w") as f:
+            # Append mode never truncates a log that a writer swapped in meanwhile
+            with open(log_file, "a") as f:
                 pass
-        with open(log_file, "r") as f:
-            for line in f:
-                try:
-                    log = json.loads(line.strip())
-                    logs.append(LogEntry(**log))
-                except json.JSONDecodeError:
-                    logger.warning(f"Invalid JSON in log file {log_file}: {line.strip()}")
-                    continue
+        with open(log_file, "rb") as f:
+            lines = f.read().splitlines()
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                logs.append(log_entry_decoder.decode(line))
+            except msgspec.DecodeError as e:
+                logger.warning(f"Invalid log entry in {log_file}: {str(e)}: {line.strip()!r}")
+                continue
     except Exception as e:
         logger.error(f"Failed to read log file {log_file}: {str(e)}")
     return logs
 
+def decode_hex_key(value: Optional[str], label: str, hex_length: int) -> bytes:
+    # bytes.fromhex tolerates whitespace, so check the raw string before decoding
+    if not isinstance(value, str) or len(value) != hex_length or any(c.isspace() for c in value):
+        raise ValueError(f"{label} must be {hex_length} hex characters")
+    try:
+        return bytes.fromhex(value)
+    except ValueError:
+        raise ValueError(f"{label} must be valid hex")
+
+def save_log_atomically(save: Callable[[str], None], log_file: str) -> None:
+    # The save_log methods truncate and rewrite their target, so write a temp file
+    # beside the log and swap it in; readers keep whichever copy they opened
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(log_file)), prefix=f".{os.path.basename(log_file)}.", suffix=".tmp"
+    )
+    os.close(fd)
+    try:
+        save(tmp_path)
+        # mkstemp creates the file owner-only; keep logs readable like a plain open() would
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, log_file)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def save_tcc_log(flow: TCCFlow, log_file: str) -> List[LogEntry]:
+    # Hold the lock so the entries read back are the ones this request wrote
+    with tcc_log_lock:
+        save_log_atomically(flow.logger.save_log, log_file)
+        return read_logs(log_file)
+
+def build_llm_flow(model_name: str, num_layers: int) -> LLMFlow:
+    # Don't retry a failed default-model load (and possible download) inside a request
+    preload_error = getattr(app.state, "model_preload_error", None)
+    if model_name == DEFAULT_MODEL_NAME and preload_error:
+        raise RuntimeError(
+            f"Model {DEFAULT_MODEL_NAME} failed to load at startup ({preload_error}); "
+            "install it into the Hugging Face cache at build time and restart"
+        )
+    model_manager = getattr(app.state, "model_manager", None)
+    if model_manager is not None and model_manager.model_name != model_name:
+        model_manager = None
+    return define_llm_flow(model_name, num_layers, model_manager=model_manager)
+
 # Route handlers
 @app.get("/", response_class=HTMLResponse)
 async def root():
@@ -112,7 +206,7 @@ async def root():
         logger.error("index.html not found in static/")
         raise HTTPException(status_code=404, detail="index.html not found")
 
-@app.post("/execute", response_model=ExecuteResponse)
+@app.post("/execute", response_class=MsgspecJSONResponse, responses=EXECUTE_RESPONSES)
 async def execute(data: ExecuteInput):
     logger.debug(f"Executing script: {data.script}, payload: {data.dict()}")
     logs = []
@@ -124,28 +218,18 @@ async def execute(data: ExecuteInput):
             raise ValueError("Input data must be non-empty and at most 1024 characters")
 
         if data.script == "sheeva":
-            # Validate AES key
-            if not data.aes_key or len(data.aes_key) != 32:
-                raise ValueError("AES key must be 32 hex characters")
-            try:
-                aes_key = bytes.fromhex(data.aes_key)
-            except ValueError:
-                raise ValueError("AES key must be valid hex")
-
-            # Validate Ed25519 key
-            if not data.ed25519_key or len(data.ed25519_key) != 64:
-                raise ValueError("Ed25519 key must be 64 hex characters")
-            try:
-                ed25519_key = bytes.fromhex(data.ed25519_key)
-            except ValueError:
-                raise ValueError("Ed25519 key must be valid hex")
+            # Validate keys
+            aes_key = decode_hex_key(data.aes_key, "AES key", 32)
+            ed25519_key = decode_hex_key(data.ed25519_key, "Ed25519 key", 64)
 
             # Validate fee
             if data.fee < 1000:
                 raise ValueError("Fee must be at least 1000")
 
             logger.debug(f"Initializing TCCFlow with include_keccak={data.include_keccak}")
-            flow = define_crypto_flow(aes_key, ed25519_key, include_keccak=data.include_keccak)
+            flow = await asyncio.to_thread(
+                define_crypto_flow, aes_key, ed25519_key, include_keccak=data.include_keccak
+            )
 
             if data.commit_entropy or data.reveal_entropy:
                 output += "Warning: Entropy commit/reveal not supported in sheeva.py\n"
@@ -155,26 +239,25 @@ async def execute(data: ExecuteInput):
 
             logger.debug(f"Executing flow with input: {data.input_data}")
             # --- THIS IS THE KEY LINE: ---
-            result = flow.execute(data.input_data.encode())
+            # Flow execution is CPU-bound, so keep it off the event loop
+            result = await asyncio.to_thread(flow.execute, data.input_data.encode())
             output = result.hex()
 
             # Optionally reverse
             if data.target_output:
                 try:
                     logger.debug(f"Reversing flow with target_output: {data.target_output}")
-                    reconstructed = flow.reverse(bytes.fromhex(data.target_output))
+                    reconstructed = await asyncio.to_thread(flow.reverse, bytes.fromhex(data.target_output))
                     output += f"\nReconstructed input: {reconstructed.decode(errors='replace')}"
                 except ValueError as e:
                     output += f"\nReverse error: {str(e)}"
 
             logger.debug("Saving flow log")
-            flow.save_log("tcc_flow_log.jsonl")
-            # Use the flow's log attribute directly, if available
-            logs = flow.flow_log  # This is step-by-step, as in your class
+            logs = await asyncio.to_thread(save_tcc_log, flow, "tcc_flow_log.jsonl")
 
         # ... (rest of your code for "aivail" etc. unchanged) ...
 
-        return ExecuteResponse(output=output, logs=logs)
+        return MsgspecJSONResponse(ExecuteResponse(output=output, logs=logs))
 
     except ValueError as e:
         logger.error(f"ValueError in execute: {str(e)}")
@@ -183,7 +266,7 @@ async def execute(data: ExecuteInput):
         logger.error(f"Unexpected error in execute: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
 
-@app.post("/reverse", response_model=ExecuteResponse)
+@app.post("/reverse", response_class=MsgspecJSONResponse, responses=EXECUTE_RESPONSES)
 async def reverse(data: ExecuteInput):
     logger.debug(f"Reversing script: {data.script}, payload: {data.dict()}")
     if not data.target_output:
@@ -192,15 +275,17 @@ async def reverse(data: ExecuteInput):
         if data.script == "sheeva":
             if not data.aes_key or not data.ed25519_key:
                 raise ValueError("AES and Ed25519 keys are required")
-            flow = define_crypto_flow(bytes.fromhex(data.aes_key), bytes.fromhex(data.ed25519_key), data.include_keccak)
-            result = flow.reverse(bytes.fromhex(data.target_output))
-            flow.save_log("tcc_flow_log.jsonl")
-            return ExecuteResponse(output=result.decode(), logs=read_logs("tcc_flow_log.jsonl"))
+            aes_key = decode_hex_key(data.aes_key, "AES key", 32)
+            ed25519_key = decode_hex_key(data.ed25519_key, "Ed25519 key", 64)
+            flow = await asyncio.to_thread(define_crypto_flow, aes_key, ed25519_key, data.include_keccak)
+            result = await asyncio.to_thread(flow.reverse, bytes.fromhex(data.target_output))
+            logs = await asyncio.to_thread(save_tcc_log, flow, "tcc_flow_log.jsonl")
+            return MsgspecJSONResponse(ExecuteResponse(output=result.decode(), logs=logs))
         elif data.script == "aivail":
-            flow = define_llm_flow(data.model_name, data.num_layers)
-            result = flow.reverse(data.target_output)
-            flow.save_flow_log("llm_flow_log.jsonl")
-            return ExecuteResponse(output=result, logs=read_logs("llm_flow_log.jsonl"))
+            flow = await asyncio.to_thread(build_llm_flow, data.model_name, data.num_layers)
+            result = await asyncio.to_thread(flow.reverse, data.target_output)
+            await asyncio.to_thread(save_log_atomically, flow.save_flow_log, "llm_flow_log.jsonl")
+            return MsgspecJSONResponse(ExecuteResponse(output=result, logs=read_logs("llm_flow_log.jsonl")))
         raise HTTPException(status_code=400, detail="Invalid script")
     except ValueError as e:
         logger.error(f"ValueError in reverse: {str(e)}")
@@ -209,17 +294,17 @@ async def reverse(data: ExecuteInput):
         logger.error(f"Unexpected error in reverse: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
 
-@app.post("/reverse_arbitrary", response_model=ExecuteResponse)
+@app.post("/reverse_arbitrary", response_class=MsgspecJSONResponse, responses=EXECUTE_RESPONSES)
 async def reverse_arbitrary(data: ExecuteInput):
     logger.debug(f"Reverse arbitrary for script: {data.script}, payload: {data.dict()}")
     if not data.target_output or not data.arbitrary_input:
         raise HTTPException(status_code=400, detail="Target output and arbitrary input are required")
     try:
         if data.script == "aivail":
-            flow = define_llm_flow(data.model_name, data.num_layers)
-            result = flow.reverse_arbitrary(data.target_output, data.arbitrary_input)
-            flow.save_flow_log("llm_flow_log.jsonl")
-            return ExecuteResponse(output=result, logs=read_logs("llm_flow_log.jsonl"))
+            flow = await asyncio.to_thread(build_llm_flow, data.model_name, data.num_layers)
+            result = await asyncio.to_thread(flow.reverse_arbitrary, data.target_output, data.arbitrary_input)
+            await asyncio.to_thread(save_log_atomically, flow.save_flow_log, "llm_flow_log.jsonl")
+            return MsgspecJSONResponse(ExecuteResponse(output=result, logs=read_logs("llm_flow_log.jsonl")))
         raise HTTPException(status_code=400, detail="Only aivail supports reverse_arbitrary")
     except ValueError as e:
         logger.error(f"ValueError in reverse_arbitrary: {str(e)}")
@@ -228,7 +313,7 @@ async def reverse_arbitrary(data: ExecuteInput):
         logger.error(f"Unexpected error in reverse_arbitrary: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
 
-@app.post("/commit_entropy", response_model=ExecuteResponse)
+@app.post("/commit_entropy", response_class=MsgspecJSONResponse, responses=EXECUTE_RESPONSES)
 async def commit_entropy(data: ExecuteInput):
     logger.debug(f"Committing entropy for script: {data.script}, payload: {data.dict()}")
     if not data.commit_entropy:
@@ -238,11 +323,11 @@ async def commit_entropy(data: ExecuteInput):
             coordinator = LLMCoordinator(LLMEntropyEngine(), LLMEntropyEngine(), LLMEntropyEngine())
             seed, temp = map(float, data.commit_entropy.split(":"))
             coordinator.commit_sampling_all(data.user_id, int(seed), temp, int(seed), temp, int(seed), temp)
-            coordinator.save_log("llm_flow_log.jsonl")
-            return ExecuteResponse(
+            save_log_atomically(coordinator.save_log, "llm_flow_log.jsonl")
+            return MsgspecJSONResponse(ExecuteResponse(
                 output=f"Committed sampling for {data.user_id}: seed={seed}, temp={temp}",
                 logs=read_logs("llm_flow_log.jsonl")
-            )
+            ))
         raise HTTPException(status_code=400, detail="Only aivail supports commit_entropy")
     except ValueError as e:
         logger.error(f"ValueError in commit_entropy: {str(e)}")
@@ -251,7 +336,7 @@ async def commit_entropy(data: ExecuteInput):
         logger.error(f"Unexpected error in commit_entropy: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
 
-@app.post("/reveal_entropy", response_model=ExecuteResponse)
+@app.post("/reveal_entropy", response_class=MsgspecJSONResponse, responses=EXECUTE_RESPONSES)
 async def reveal_entropy(data: ExecuteInput):
     logger.debug(f"Revealing entropy for script: {data.script}, payload: {data.dict()}")
     if not data.reveal_entropy:
@@ -261,11 +346,11 @@ async def reveal_entropy(data: ExecuteInput):
             coordinator = LLMCoordinator(LLMEntropyEngine(), LLMEntropyEngine(), LLMEntropyEngine())
             seed, temp = map(float, data.reveal_entropy.split(":"))
             coordinator.reveal_sampling_all(data.user_id, int(seed), temp, int(seed), temp, int(seed), temp, data.fee)
-            coordinator.save_log("llm_flow_log.jsonl")
-            return ExecuteResponse(
+            save_log_atomically(coordinator.save_log, "llm_flow_log.jsonl")
+            return MsgspecJSONResponse(ExecuteResponse(
                 output=f"Revealed sampling for {data.user_id}: seed={seed}, temp={temp}",
                 logs=read_logs("llm_flow_log.jsonl")
-            )
+            ))
         raise HTTPException(status_code=400, detail="Only aivail supports reveal_entropy")
     except ValueError as e:
         logger.error(f"ValueError in reveal_entropy: {str(e)}")
@@ -274,29 +359,49 @@ async def reveal_entropy(data: ExecuteInput):
         logger.error(f"Unexpected error in reveal_entropy: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
 
-@app.post("/deploy_shard", response_model=ExecuteResponse)
+@app.post("/deploy_shard", response_class=MsgspecJSONResponse, responses=EXECUTE_RESPONSES)
 async def deploy_shard(data: ExecuteInput):
     logger.debug(f"Deploying shard for script: {data.script}, payload: {data.dict()}")
     try:
         if data.script == "sheeva":
-            return ExecuteResponse(
+            return MsgspecJSONResponse(ExecuteResponse(
                 output="Shard deployment not supported in sheeva.py",
                 logs=read_logs("tcc_flow_log.jsonl")
-            )
+            ))
         raise HTTPException(status_code=400, detail="Only sheeva supports deploy_shard")
     except Exception as e:
         logger.error(f"Unexpected error in deploy_shard: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
 
-@app.get("/logs/{log_file}", response_model=LogsResponse)
+@app.get("/logs/{log_file}", responses=LOGS_RESPONSES)
 async def get_logs(log_file: str):
     logger.debug(f"Fetching logs for file: {log_file}")
-    if log_file not in ["tcc_flow_log.jsonl", "llm_flow_log.jsonl"]:
+    if log_file not in LOG_FILES:
         raise HTTPException(
             status_code=400,
             detail="Invalid log file. Use 'tcc_flow_log.jsonl' or 'llm_flow_log.jsonl'."
         )
-    logs = read_logs(log_file)
-    if not logs and not os.path.exists(log_file):
-        return LogsResponse(logs=[])
-    return LogsResponse(logs=logs)
\ No newline at end of file
+
+    def stream_logs():
+        # Writers swap logs in atomically, so this handle keeps a consistent copy while streaming.
+        # Validate each line as a LogEntry and re-encode it, so the array only holds well-formed entries
+        yield b'{"logs":['
+        if os.path.exists(log_file):
+            with open(log_file, "rb") as f:
+                first = True
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = log_entry_decoder.decode(line)
+                    except msgspec.DecodeError as e:
+                        logger.warning(f"Invalid log entry in {log_file}: {str(e)}: {line!r}")
+                        continue
+                    if not first:
+                        yield b','
+                    yield msgspec.json.encode(entry)
+                    first = False
+        yield b']}'
+
+    return StreamingResponse(stream_logs(), media_type="application/json")